@@ -1,13 +1,62 @@
 #!/usr/bin/env python3
 import os
+import sys
 import time
 import json
+import asyncio
+import hashlib
 import argparse
 import subprocess
 from urllib.request import urlopen, Request
-from typing import Dict
+from urllib.error import HTTPError
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
+class TickerLog:
+    """Timestamped log lines to the console and to a log file that stays open.
+
+    File writes are buffered and flushed at most every ``flush_interval``
+    seconds (and on flush()/close()) instead of reopening the file per line.
+    """
+
+    def __init__(self, verbose: bool = False, path: str = '', flush_interval: float = 1.0):
+        self.verbose = verbose
+        self.flush_interval = flush_interval
+        self.file = None
+        self.last_flush = time.monotonic()
+        if path:
+            try:
+                self.file = open(path, 'a', encoding='utf-8')
+            except Exception:
+                self.file = None
+
+    def __call__(self, msg: str):
+        ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        line = f"[{ts}] {msg}"
+        if self.verbose:
+            print(line, flush=True)
+        if self.file:
+            try:
+                self.file.write(line + '\n')
+                if time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if self.file:
+            try:
+                self.file.flush()
+            except Exception:
+                pass
+
+    def close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
 def fetch_messages(url: str):
     req = Request(url, headers={'User-Agent': 'ble-ticker/1.0'})
     with urlopen(req, timeout=10) as resp:
@@ -15,6 +64,67 @@ def fetch_messages(url: str):
         payload = json.loads(data)
         return payload.get('messages', [])
 
+def fetch_messages_conditional(url: str, etag: Optional[str] = None) -> Tuple[Optional[List[str]], Optional[str]]:
+    # Returns (None, etag) when the server answers 304 Not Modified
+    headers = {'User-Agent': 'ble-ticker/1.0'}
+    if etag:
+        headers['If-None-Match'] = etag
+    try:
+        with urlopen(Request(url, headers=headers), timeout=10) as resp:
+            data = resp.read().decode('utf-8', errors='ignore')
+            return json.loads(data).get('messages', []), resp.headers.get('ETag')
+    except HTTPError as e:
+        if e.code == 304:
+            return None, etag
+        raise
+
+def split_lines(text: str) -> List[str]:
+    # Ensure exactly two lines (pad or trim)
+    lines = (text or '').split('\n')
+    if len(lines) == 1:
+        lines.append('')
+    return lines[:2]
+
+def load_daemon_client(ipixel_path: str):
+    # daemon_client.py lives next to ipixelcli.py and only needs the standard library
+    ipixel_dir = os.path.dirname(os.path.abspath(ipixel_path)) or '.'
+    if ipixel_dir not in sys.path:
+        sys.path.insert(0, ipixel_dir)
+    import daemon_client
+    return daemon_client
+
+def load_tracing(ipixel_path: str):
+    # tracing.py lives next to ipixelcli.py too; it is a no-op unless IPIXEL_TRACE is set
+    load_daemon_client(ipixel_path)
+    import tracing
+    return tracing
+
+def send_line_daemon(daemon: str, ipixel_path: str, mac: str, line: str, speed: int, color: str, animation: int):
+    client = load_daemon_client(ipixel_path)
+    host, port = client.parse_daemon_address(daemon)
+    params = [line, f'animation={animation}', f'speed={speed}', f'color={color}']
+    resp = client.send_command('send_text', params, address=mac, host=host, port=port)
+    if resp.get('status') != 'success':
+        raise RuntimeError(f"ble_daemon: {resp.get('message')}")
+
+def send_two_line_daemon(daemon: str, ipixel_path: str, mac: str, line1: str, line2: str, png_opts: Dict[str, str],
+                         prerender: bool = False):
+    client = load_daemon_client(ipixel_path)
+    host, port = client.parse_daemon_address(daemon)
+    resp = client.send_two_line(
+        line1, line2, address=mac, host=host, port=port,
+        animate=bool(png_opts.get('animate')),
+        scroll=bool(png_opts.get('scroll')),
+        once=bool(png_opts.get('once')),
+        period_ms=png_opts.get('period_ms') or None,
+        step=png_opts.get('step') or None,
+        align=png_opts.get('align') or None,
+        optimize=bool(png_opts.get('optimize')),
+        prerender=prerender or None,
+    )
+    if resp.get('status') != 'success':
+        raise RuntimeError(f"ble_daemon: {resp.get('message')}")
+
 def send_line(ipixel_path: str, mac: str, line: str, python_exec: str, speed: int, color: str, animation: int):
     # Ensure quotes are passed safely
     ipixel_abs = os.path.abspath(ipixel_path)
@@ -51,9 +161,216 @@ def send_two_line_png(ipixel_path: str, mac: str, line1: str, line2: str, python
         extras.append(f"step={png_opts['step']}")
     if 'align' in png_opts and png_opts['align']:
         extras.append(f"align={png_opts['align']}")
+    if png_opts.get('optimize'):
+        extras.append('optimize=1')
     cmd = [python_exec, two_line_py, mac, line1, line2] + extras
     subprocess.run(cmd, check=True, cwd=ipixel_dir)
 
+def load_ipixel_modules(ipixel_path: str):
+    # Import the iPixel-CLI modules in-process; fonts resolve relative to that folder
+    ipixel_dir = os.path.dirname(os.path.abspath(ipixel_path)) or '.'
+    if ipixel_dir not in sys.path:
+        sys.path.insert(0, ipixel_dir)
+    os.chdir(ipixel_dir)
+    import commands
+    import transport
+    import two_line_png
+    from panel_pool import PanelConnection
+    return commands, transport, two_line_png, PanelConnection
+
+async def run_pipeline(args, mac: str, log: TickerLog, trace):
+    """Fetch, render and send as three tasks joined by bounded queues.
+
+    The fetcher polls with If-None-Match and also compares a hash of the
+    messages, so an unchanged ticker is neither rendered nor sent again. A
+    failed render or send forgets both, so the next poll fetches and sends
+    the ticker again. The
+    renderer prepares message N+1 while message N is being written or is on
+    screen, and the sender holds each message for ``--dwell`` seconds (by
+    default the poll interval shared between the fetched messages) before
+    sending the next. A looping scroll counts as sent once its first frame is
+    on the panel. Without
+    ``--daemon`` the panel connection stays open between messages
+    (``--fake-panel`` swaps it for fake_ble.py). With ``--daemon`` the render
+    stage asks the daemon to pre-render PNG messages into its render cache;
+    text messages are encoded by the daemon when they are sent.
+    """
+    messages_q: asyncio.Queue = asyncio.Queue(maxsize=1)
+    rendered_q: asyncio.Queue = asyncio.Queue(maxsize=max(1, args.queue_size))
+    png_opts = {
+        'animate': bool(args.animate),
+        'scroll': bool(args.scroll),
+        'once': bool(args.scroll_once),
+        'period_ms': str(args.period_ms),
+        'step': str(args.step),
+        'align': args.align,
+        'optimize': bool(args.optimize)
+    }
+
+    panel = None
+    if not args.daemon:
+        commands, transport, two_line_png, PanelConnection = load_ipixel_modules(args.ipixel)
+        factory = None
+        if args.fake_panel:
+            from fake_ble import fake_client_factory
+            factory = fake_client_factory(connect_latency_ms=args.fake_connect_ms, write_latency_ms=args.fake_write_ms)
+        panel = PanelConnection(mac, client_factory=factory).start()
+
+    def render(line1: str, line2: str):
+        # Returns (job, preemptible, shown) for the panel, or a blocking callable for the daemon;
+        # shown is an Event set once a job that never finishes has put its first frame up
+        # send_text rejects empty text, so a one-line message sends one line
+        lines = [line for line in (line1, line2) if line]
+        if args.daemon:
+            if args.mode == 'png':
+                # Render in the daemon now; the send then hits its render cache
+                send_two_line_daemon(args.daemon, args.ipixel, mac, line1, line2, png_opts, prerender=True)
+                return (lambda: send_two_line_daemon(args.daemon, args.ipixel, mac, line1, line2, png_opts)), False, None
+
+            def send_text_lines():
+                for i, line in enumerate(lines):
+                    if i:
+                        time.sleep(0.5)
+                    send_line_daemon(args.daemon, args.ipixel, mac, line, args.speed, args.color, args.animation)
+            return send_text_lines, False, None
+        if args.mode == 'png':
+            if args.scroll:
+                loop = not args.scroll_once
+                frames = two_line_png.render_payload(line1, line2, 'scroll', args.step, args.period_ms, args.align, loop,
+                                                     optimize=args.optimize)
+
+                shown = asyncio.Event()
+
+                async def write(client, data):
+                    await transport.write_payload(client, data, 'scroll')
+                    shown.set()
+
+                async def scroll(client):
+                    await two_line_png.stream_scroll(mac, None, args.step, args.period_ms, loop, client=client, frames=frames,
+                                                     write=lambda data: write(client, data))
+                # A looping scroll never ends; the next message replaces it
+                return scroll, loop, shown if loop else None
+            mode = 'gif' if args.animate else 'png'
+            return two_line_png.render_payload(line1, line2, mode, args.step, args.period_ms, args.align,
+                                               optimize=args.optimize), False, None
+        text = [commands.send_text(line, animation=args.animation, speed=args.speed, color=args.color)
+                for line in lines]
+
+        async def text_lines(client):
+            for i, payload in enumerate(text):
+                if i:
+                    await asyncio.sleep(0.5)
+                await transport.write_payload(client, payload, 'send_text')
+        return text_lines, False, None
+
+    # ETag and hash of the last fetched messages; cleared when one of them fails to go out
+    etag, digest = None, None
+
+    def refetch():
+        nonlocal etag, digest
+        etag, digest = None, None
+
+    async def fetcher():
+        nonlocal etag, digest
+        while True:
+            started = time.monotonic()
+            try:
+                with trace.span('fetch', url=args.url) as span:
+                    sent_etag = etag
+                    messages, new_etag = await asyncio.to_thread(fetch_messages_conditional, args.url, sent_etag)
+                    span.add(modified=messages is not None)
+                if etag == sent_etag:
+                    # Unless a failure asked for a full fetch meanwhile
+                    etag = new_etag
+                if messages is None:
+                    log('Ticker not modified (304), skipping cycle.')
+                else:
+                    current = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).hexdigest()
+                    if current == digest:
+                        log('Ticker unchanged, skipping cycle.')
+                    elif messages:
+                        digest = current
+                        await messages_q.put(messages)
+            except Exception as e:
+                log(f"Error: {e}")
+            if args.once:
+                await messages_q.put(None)
+                return
+            await asyncio.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+    async def renderer():
+        while True:
+            messages = await messages_q.get()
+            if messages is None:
+                await rendered_q.put(None)
+                return
+            for idx, text in enumerate(messages):
+                lines = split_lines(text)
+                log(f"Fetched message[{idx}] | line1='{lines[0]}' line2='{lines[1]}'")
+                if args.log_plain:
+                    log(f"Plain: {lines[1]}")
+                began = time.perf_counter()
+                try:
+                    job, preemptible, shown = await asyncio.to_thread(render, lines[0], lines[1])
+                except Exception as e:
+                    log(f"Render error: {e}")
+                    refetch()
+                    continue
+                log(f"Rendered message[{idx}] in {(time.perf_counter() - began) * 1000:.1f}ms")
+                await rendered_q.put((idx, len(messages), tuple(lines), job, preemptible, shown))
+
+    async def show(job, shown):
+        # Submit a job that never finishes and wait until its first frame is up
+        future = await panel.submit(job, preemptible=True)
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        waiter = asyncio.ensure_future(shown.wait())
+        try:
+            await asyncio.wait({future, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if not shown.is_set():
+            if future.cancelled():
+                raise RuntimeError('replaced before its first frame')
+            future.result()
+
+    async def sender():
+        on_screen = None
+        hold_until = 0.0
+        while True:
+            item = await rendered_q.get()
+            if item is None:
+                return
+            idx, count, lines, job, preemptible, shown = item
+            if lines == on_screen:
+                log(f"Message[{idx}] already on screen, skipping.")
+                continue
+            # Leave the previous message up for its dwell before replacing it
+            await asyncio.sleep(max(0.0, hold_until - time.monotonic()))
+            began = time.perf_counter()
+            try:
+                with trace.span('send', index=idx, mode=args.mode, daemon=panel is None):
+                    if panel is None:
+                        await asyncio.to_thread(job)
+                    elif preemptible:
+                        await show(job, shown)
+                    else:
+                        await (await panel.submit(job))
+                on_screen = lines
+                dwell = args.dwell if args.dwell is not None else args.interval / max(1, count)
+                hold_until = time.monotonic() + dwell
+                log(f"Sent message[{idx}] in {(time.perf_counter() - began) * 1000:.1f}ms")
+            except Exception as e:
+                log(f"Error: {e}")
+                refetch()
+            log.flush()
+
+    try:
+        await asyncio.gather(fetcher(), renderer(), sender())
+    finally:
+        if panel is not None:
+            await panel.close()
+        log.close()
+
 def main():
     parser = argparse.ArgumentParser(description='Push LED ticker two-line messages to iPixel over BLE.')
     parser.add_argument('--mac', default=os.environ.get('BLE_MAC', '410B2C35-FBEB-A20E-CB42-C690C2A28E2D'), help='BLE MAC/Address for the display')
@@ -65,6 +382,7 @@ def main():
     parser.add_argument('--animation', type=int, default=int(os.environ.get('IPIXEL_ANIMATION', '1')), help='Animation style (0-7)')
     parser.add_argument('--interval', type=int, default=int(os.environ.get('TICKER_INTERVAL', '60')), help='Poll interval seconds')
     parser.add_argument('--once', action='store_true', help='Send once and exit')
+    parser.add_argument('--daemon', default=os.environ.get('IPIXEL_DAEMON', ''), help='Send through a running ble_daemon.py at host:port instead of spawning ipixelcli')
     parser.add_argument('--mode', choices=['text', 'png'], default=os.environ.get('IPIXEL_MODE', 'png'), help='Send as text or rendered PNG')
     # PNG-specific options
     parser.add_argument('--animate', action='store_true', default=os.environ.get('PNG_ANIMATE', 'false').lower() in ('1','true','yes'), help='Enable GIF scroll animation')
@@ -72,12 +390,20 @@ def main():
     parser.add_argument('--scroll_once', action='store_true', default=os.environ.get('PNG_SCROLL_ONCE', 'false').lower() in ('1','true','yes'), help='When scrolling, perform one pass then return')
     parser.add_argument('--period_ms', type=int, default=int(os.environ.get('PNG_PERIOD_MS', '40')), help='Frame/scroll period in ms')
     parser.add_argument('--step', type=int, default=int(os.environ.get('PNG_STEP', '1')), help='Scroll step in pixels')
+    parser.add_argument('--optimize', action='store_true', default=os.environ.get('PNG_OPTIMIZE', 'false').lower() in ('1','true','yes'), help='Send the smallest PNG/GIF encoding (palette PNG, GIF deltas) by byte count')
     parser.add_argument('--align', choices=['left','center','right'], default=os.environ.get('PNG_ALIGN', 'center'), help='Text alignment for PNG')
     # Logging
     parser.add_argument('--verbose', action='store_true', help='Enable verbose console logging')
     parser.add_argument('--log-file', default=os.environ.get('BLE_LOG_FILE', ''), help='Append debug logs to this file')
     parser.add_argument('--log-plain', action='store_true', default=os.environ.get('BLE_LOG_PLAIN', 'false').lower() in ('1','true','yes'), help='Log only the human-readable line (omit LED sensor formatting)')
     parser.add_argument('--dedupe', action='store_true', default=os.environ.get('BLE_DEDUPE', 'false').lower() in ('1','true','yes'), help='Skip sending duplicate plain-text messages back-to-back')
+    # Pipelined mode
+    parser.add_argument('--pipeline', action='store_true', default=os.environ.get('TICKER_PIPELINE', 'false').lower() in ('1','true','yes'), help='Fetch, render and send concurrently; skip unchanged tickers (ETag + hash)')
+    parser.add_argument('--dwell', type=float, default=float(os.environ['TICKER_DWELL']) if os.environ.get('TICKER_DWELL') else None, help='With --pipeline, seconds to hold each message before sending the next (default: --interval divided by the number of messages)')
+    parser.add_argument('--queue-size', type=int, default=int(os.environ.get('TICKER_QUEUE_SIZE', '2')), help='With --pipeline, rendered messages buffered ahead of the panel')
+    parser.add_argument('--fake-panel', action='store_true', help='With --pipeline, write to an in-process fake panel instead of BLE')
+    parser.add_argument('--fake-connect-ms', type=float, default=1500, help='Simulated connect latency (with --fake-panel)')
+    parser.add_argument('--fake-write-ms', type=float, default=30, help='Simulated per-write latency (with --fake-panel)')
     args = parser.parse_args()
 
     if not args.mac:
@@ -92,33 +418,45 @@ def main():
     if mac.startswith('-'):
         mac = mac.lstrip('-')
 
-    def log(msg: str):
-        ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        line = f"[{ts}] {msg}"
-        if args.verbose:
-            print(line, flush=True)
-        if args.log_file:
-            try:
-                with open(args.log_file, 'a', encoding='utf-8') as f:
-                    f.write(line + '\n')
-            except Exception:
-                pass
+    log = TickerLog(args.verbose, args.log_file)
+    trace = load_tracing(args.ipixel)
+
+    log(f"Starting BLE sender | url={args.url} mode={args.mode} scroll={args.scroll} animate={args.animate} mac={mac} daemon={args.daemon or 'off'} pipeline={args.pipeline}")
+
+    if args.pipeline:
+        if args.fake_panel:
+            args.daemon = ''
+        try:
+            asyncio.run(run_pipeline(args, mac, log, trace))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            log.close()
+        return
+
+    def two_line(line1: str, line2: str, png_opts: Dict[str, str]):
+        with trace.span('send', mode='png', daemon=bool(args.daemon)):
+            if args.daemon:
+                send_two_line_daemon(args.daemon, args.ipixel, mac, line1, line2, png_opts)
+            else:
+                send_two_line_png(args.ipixel, mac, line1, line2, args.python, png_opts)
 
-    log(f"Starting BLE sender | url={args.url} mode={args.mode} scroll={args.scroll} animate={args.animate} mac={mac}")
+    def text_line(line: str):
+        with trace.span('send', mode='text', daemon=bool(args.daemon)):
+            if args.daemon:
+                send_line_daemon(args.daemon, args.ipixel, mac, line, args.speed, args.color, args.animation)
+            else:
+                send_line(args.ipixel, mac, line, args.python, args.speed, args.color, args.animation)
 
     last_plain = None
     while True:
         try:
-            messages = fetch_messages(args.url)
+            with trace.span('fetch', url=args.url):
+                messages = fetch_messages(args.url)
             if messages:
                 # Rotate through all messages so both phases are shown (decision/order/position/exit)
                 for idx, text in enumerate(messages):
-                    lines = (text or '').split('\n')
-                    # Ensure exactly two lines (pad or trim)
-                    if len(lines) == 1:
-                        lines.append('')
-                    elif len(lines) > 2:
-                        lines = lines[:2]
+                    lines = split_lines(text)
                     log(f"Fetched message[{idx}] | line1='{lines[0]}' line2='{lines[1]}'")
                     plain_line = lines[1] if len(lines) > 1 else lines[0]
                     if args.log_plain:
@@ -134,31 +472,34 @@ def main():
                             'once': bool(args.scroll_once),
                             'period_ms': str(args.period_ms),
                             'step': str(args.step),
-                            'align': args.align
+                            'align': args.align,
+                            'optimize': bool(args.optimize)
                         }
                         if args.scroll:
                             log("Sending PNG manual scroll...")
-                            send_two_line_png(args.ipixel, mac, lines[0], lines[1], args.python, png_opts)
+                            two_line(lines[0], lines[1], png_opts)
                             log("PNG scroll done")
                         else:
                             log("Sending PNG animate (gif)...")
-                            send_two_line_png(args.ipixel, mac, lines[0], lines[1], args.python, png_opts)
+                            two_line(lines[0], lines[1], png_opts)
                             log("PNG animate sent OK")
                     else:
                         # Send line 1 then line 2 (if not PNG mode)
                         log(f"Sending TEXT line 1...")
-                        send_line(args.ipixel, mac, lines[0], args.python, args.speed, args.color, args.animation)
+                        text_line(lines[0])
                         time.sleep(0.5)
                         log(f"Sending TEXT line 2...")
-                        send_line(args.ipixel, mac, lines[1], args.python, args.speed, args.color, args.animation)
+                        text_line(lines[1])
                     if idx == 0:
                         last_plain = plain_line
         except Exception as e:
             log(f"Error: {e}")
 
+        log.flush()
         if args.once:
             break
         time.sleep(args.interval)
+    log.close()
 
 if __name__ == '__main__':
     main()
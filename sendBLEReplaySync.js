@@ -12,12 +12,15 @@ const { authorizeGoogleSheets, readTradesFromSheet, readReplayFeed } = require('
 const { google } = require('googleapis');
 const { GoogleAuth } = require('google-auth-library');
 const { spawn } = require('child_process');
+const net = require('net');
 const path = require('path');
 const { createTickerMessages } = require('./tickerTape');
 
 const SPREADSHEET_ID = process.env.GOOGLE_SPREADSHEET_ID;
 const BLE_MAC = process.env.BLE_MAC || '410B2C35-FBEB-A20E-CB42-C690C2A28E2D';
 const SHEET_NAME = 'BLE Display';
+// host:port of a running vendor/iPixel-CLI/ble_daemon.py (optional)
+const IPIXEL_DAEMON = process.env.IPIXEL_DAEMON || '';
 let sheets = null;
 
 // Function to read BLE Display data for a specific date
@@ -157,8 +160,67 @@ async function readBLEDisplayData(targetDate, timezone = 'Asia/Seoul') {
   }
 }
 
+// Send through ble_daemon.py: one JSON line over TCP, no Python start-up or BLE reconnect
+function sendToDaemon(line1, line2, options = {}) {
+  return new Promise((resolve, reject) => {
+    const [host, port] = (options.daemon || IPIXEL_DAEMON).includes(':')
+      ? (options.daemon || IPIXEL_DAEMON).split(':')
+      : ['127.0.0.1', options.daemon || IPIXEL_DAEMON];
+    const request = {
+      command: 'two_line',
+      address: options.mac || BLE_MAC,
+      line1,
+      line2,
+      scroll: options.scroll !== false,
+      once: options.scrollOnce !== false,
+      period_ms: options.periodMs || 26,
+      step: options.step || 2,
+      align: options.align || 'center'
+    };
+
+    console.log(`📤 Sending to BLE daemon: "${line1}" / "${line2}"`);
+
+    const socket = net.createConnection({ host: host || '127.0.0.1', port: Number(port) }, () => {
+      socket.write(JSON.stringify(request) + '\n');
+    });
+    let buffer = '';
+    let settled = false;
+    socket.setEncoding('utf8');
+    // Same limit as daemon_client.py: don't let a stuck daemon hang the replay loop
+    socket.setTimeout(options.timeoutMs || 60000, () => {
+      socket.destroy(new Error('BLE daemon timed out'));
+    });
+    socket.on('data', (chunk) => {
+      buffer += chunk;
+      if (!buffer.includes('\n')) return;
+      settled = true;
+      socket.end();
+      try {
+        const response = JSON.parse(buffer.split('\n')[0]);
+        if (response.status === 'success') {
+          resolve(response);
+        } else {
+          reject(new Error(`BLE daemon error: ${response.message}`));
+        }
+      } catch (error) {
+        reject(error);
+      }
+    });
+    socket.on('error', (error) => {
+      settled = true;
+      reject(error);
+    });
+    socket.on('close', () => {
+      if (!settled) reject(new Error('BLE daemon closed the connection without a response'));
+    });
+  });
+}
+
 // Function to send data to BLE device
 function sendToBLE(line1, line2, options = {}) {
+  if (options.daemon || IPIXEL_DAEMON) {
+    return sendToDaemon(line1, line2, options);
+  }
   return new Promise((resolve, reject) => {
     const ipixelPath = path.join(__dirname, 'vendor/iPixel-CLI/ipixelcli.py');
     let pythonExec = options.python;
@@ -775,5 +837,5 @@ if (require.main === module) {
   sendBLEReplaySync();
 }
 
-module.exports = { sendBLEReplaySync, sendToBLE };
+module.exports = { sendBLEReplaySync, sendToBLE, sendToDaemon };
 